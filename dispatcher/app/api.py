@@ -2,12 +2,12 @@
 import os
 from uuid import UUID
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException
 from pydantic import BaseModel
-from sqlalchemy import text
+from sqlalchemy import Connection, text
 
 from . import db
-from .db import get_session, run_migrations
+from .db import get_conn, get_session, run_migrations
 
 app = FastAPI(title="Webhook Dispatcher", version="1.0.0")
 
@@ -23,6 +23,10 @@ DEFAULT_TARGET_URL = os.environ.get(
     "http://localhost:8080/webhook",
 )
 
+_GET_EVENT_STMT = text(
+    "SELECT id, status, attempt_count, next_retry_at, last_error, created_at FROM webhook_events WHERE id = :id"
+)
+
 
 class EventIngestion(BaseModel):
     payload: dict
@@ -33,17 +37,18 @@ class EventIngestion(BaseModel):
 
 
 @app.post("/events", status_code=202)
-def post_events(event: EventIngestion):
+def post_events(event: EventIngestion, conn: Connection = Depends(get_conn)):
     """Accept event, store in Postgres as pending, return 202 with event id."""
     target_url = event.target_url or DEFAULT_TARGET_URL
     # Basic URL check
     if not target_url.startswith(("http://", "https://")):
         raise HTTPException(422, detail="target_url must be http or https")
-    with get_session() as session:
-        try:
-            event_id = db.insert_event(session, event.payload, target_url)
-        except Exception as e:
-            raise HTTPException(500, detail=str(e))
+    try:
+        event_id = db.insert_event(conn, event.payload, target_url)
+        # Commit before answering 202: the event must be durable once accepted
+        conn.commit()
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
     return {
         "id": str(event_id),
         "status": "accepted",
@@ -51,16 +56,10 @@ def post_events(event: EventIngestion):
 
 
 @app.get("/events/{event_id}")
-def get_event(event_id: UUID):
+def get_event(event_id: UUID, conn: Connection = Depends(get_conn)):
     """Return event status (optional, for debugging)."""
-    with get_session() as session:
-        r = session.execute(
-            text(
-                "SELECT id, status, attempt_count, next_retry_at, last_error, created_at FROM webhook_events WHERE id = :id"
-            ),
-            {"id": event_id},
-        )
-        row = r.fetchone()
+    r = conn.execute(_GET_EVENT_STMT, {"id": event_id})
+    row = r.fetchone()
     if not row:
         raise HTTPException(404, detail="Event not found")
     return dict(row._mapping)
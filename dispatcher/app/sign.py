@@ -1,13 +1,58 @@
 """HMAC-SHA256 signing for webhook payloads. Receiver verifies with shared secret."""
-import hmac
 import hashlib
+import os
+import ssl
 
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "change-me-in-production")
 
-def sign_payload(secret: str, body: bytes) -> str:
-    """Compute HMAC-SHA256(secret, body) and return hex string for X-Webhook-Signature."""
-    sig = hmac.new(
-        secret.encode("utf-8") if isinstance(secret, str) else secret,
-        body,
-        hashlib.sha256,
-    ).hexdigest()
-    return f"sha256={sig}"
+_BLOCK_SIZE = 64  # SHA-256 block size in bytes
+
+
+def _hmac_prototypes(secret: str | bytes) -> tuple:
+    """Return SHA-256 states already fed with the HMAC inner (ipad) and outer (opad) keys."""
+    key = secret.encode("utf-8") if isinstance(secret, str) else secret
+    if len(key) > _BLOCK_SIZE:
+        key = hashlib.sha256(key).digest()
+    key = key.ljust(_BLOCK_SIZE, b"\x00")
+    inner = hashlib.sha256(bytes(b ^ 0x36 for b in key))
+    outer = hashlib.sha256(bytes(b ^ 0x5C for b in key))
+    return inner, outer
+
+
+# Key processing happens once at import; each signature only copies these states
+_INNER, _OUTER = _hmac_prototypes(WEBHOOK_SECRET)
+
+
+def _cpu_has_sha_extensions() -> bool | None:
+    """True if the CPU advertises SHA-256 instructions (x86 sha_ni, arm64 sha2); None if unknown."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    flags = line.split(":", 1)[1].split()
+                    return "sha_ni" in flags or "sha2" in flags
+    except OSError:
+        pass
+    return None
+
+
+def hash_backend() -> str:
+    """Describe the SHA-256 implementation used for signing (logged at worker startup).
+
+    OpenSSL >= 1.1.1 dispatches to SHA-NI / ARMv8 SHA instructions when the CPU has them;
+    CPython's builtin fallback (no OpenSSL) is plain software.
+    """
+    if hashlib.sha256.__name__ == "openssl_sha256":
+        backend = ssl.OPENSSL_VERSION
+    else:
+        backend = "builtin (no OpenSSL)"
+    return f"{backend}, cpu_sha_extensions={_cpu_has_sha_extensions()}"
+
+
+def sign_payload(body: bytes) -> str:
+    """Compute HMAC-SHA256(WEBHOOK_SECRET, body) and return hex string for X-Webhook-Signature."""
+    inner = _INNER.copy()
+    inner.update(body)
+    outer = _OUTER.copy()
+    outer.update(inner.digest())
+    return f"sha256={outer.hexdigest()}"
@@ -1,125 +1,354 @@
-"""Background worker: poll Postgres, claim pending events, deliver with HMAC, backoff on failure."""
-import json
+"""Background worker: wait for NOTIFY (or poll), claim pending events, deliver with HMAC, backoff on failure."""
+import asyncio
 import logging
 import os
 import random
+import socket
 import time
+from contextlib import suppress
 from datetime import datetime, timezone, timedelta
-from uuid import UUID
 
 import httpx
-from sqlalchemy.orm import Session
+from sqlalchemy import Connection
 
-from .db import SessionLocal, claim_pending_events, record_attempt, mark_delivered, mark_failed
-from .sign import sign_payload
+from .db import (
+    claim_pending_events,
+    engine,
+    mark_delivered,
+    mark_failed,
+    open_listen_connection,
+    reclaim_stale_events,
+    record_attempts,
+    seconds_until_next_retry,
+    serialize_payload,
+)
+from .sign import hash_backend, sign_payload
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("dispatcher.worker")
 
-WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "change-me-in-production")
 HTTP_TIMEOUT = int(os.environ.get("HTTP_TIMEOUT", "15"))
 POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", "1.5"))
+MAX_POLL_INTERVAL = float(os.environ.get("WORKER_MAX_POLL_INTERVAL", "30"))
+POLLING_INTERVAL_FACTOR = float(os.environ.get("WORKER_POLL_BACKOFF_FACTOR", "2"))
+MIN_WAIT = 0.05  # floor for waits on an overdue-but-unclaimable retry (e.g. briefly row-locked)
 CLAIM_LIMIT = int(os.environ.get("WORKER_CLAIM_LIMIT", "10"))
+# Max deliveries in flight at once across all claimed batches
+DELIVERY_CONCURRENCY = int(os.environ.get("WORKER_DELIVERY_CONCURRENCY", "100"))
+WORKER_ID = os.environ.get("WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+# in_flight rows older than this are assumed orphaned by a crashed worker and returned to pending
+IN_FLIGHT_TIMEOUT = float(os.environ.get("WORKER_IN_FLIGHT_TIMEOUT", "300"))
 MAX_ATTEMPTS = int(os.environ.get("MAX_ATTEMPTS", "20"))
 BACKOFF_BASE_SECONDS = float(os.environ.get("BACKOFF_BASE_SECONDS", "2"))
 BACKOFF_MAX_SECONDS = float(os.environ.get("BACKOFF_MAX_SECONDS", "3600"))  # 1 hour
 
+RESPONSE_BODY_LIMIT = 2000  # bytes of the receiver's response kept in delivery_attempts
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "1000"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "100"))
+
+# One pooled client for all deliveries: keep-alive connections skip the TCP/TLS handshake per event,
+# and HTTP/2 (negotiated via ALPN on https targets) multiplexes retries to the same host
+_CLIENT = httpx.AsyncClient(
+    timeout=HTTP_TIMEOUT,
+    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+    http2=True,
+)
+
+
+# base * 2^n saturated at BACKOFF_MAX_SECONDS, indexed by attempt count (computed once at import)
+_BACKOFF_SCHEDULE = tuple(
+    min(BACKOFF_BASE_SECONDS * (1 << n), BACKOFF_MAX_SECONDS) for n in range(MAX_ATTEMPTS + 2)
+)
+
 
 def backoff_with_jitter(attempt_count: int) -> datetime:
-    """Exponential backoff with jitter. next_retry_at = now + base * 2^attempt + jitter."""
-    delay = min(
-        BACKOFF_BASE_SECONDS * (2 ** attempt_count) + random.uniform(0, 1),
-        BACKOFF_MAX_SECONDS,
-    )
+    """Exponential backoff with proportional jitter: next_retry_at = now + uniform(50%, 100%) of base * 2^attempt.
+
+    Jitter scales with the delay, so events that failed together (e.g. during a receiver outage)
+    spread out instead of all waking at the same capped time.
+    """
+    delay = _BACKOFF_SCHEDULE[min(attempt_count, len(_BACKOFF_SCHEDULE) - 1)]
+    delay = random.uniform(delay * 0.5, delay)
     return datetime.now(timezone.utc) + timedelta(seconds=delay)
 
 
-def deliver_one(session: Session, event: dict) -> None:
-    """Send one event to target_url with HMAC; update DB on success/failure."""
+async def read_capped(resp: httpx.Response, limit: int) -> bytes:
+    """Read at most limit bytes of a streamed response body, leaving the rest unread."""
+    buf = bytearray()
+    async for chunk in resp.aiter_bytes():
+        buf += chunk
+        if len(buf) >= limit:
+            break
+    return bytes(buf[:limit])
+
+
+async def deliver_one(event: dict) -> dict:
+    """Send one event to target_url with HMAC; return status_code/response_body/error for recording."""
     event_id = event["id"]
     target_url = event["target_url"]
-    payload = event["payload"]
-    attempt_count = event["attempt_count"]
-    attempt_number = attempt_count + 1
+    attempt_number = event["attempt_count"] + 1
 
-    body = json.dumps(payload).encode("utf-8")
-    signature = sign_payload(WEBHOOK_SECRET, body)
+    if event["signature"] is not None:
+        # psycopg2 returns BYTEA as a memoryview; httpx needs bytes, so copy exactly once here
+        body = bytes(event["body"])
+        signature = event["signature"]
+    else:
+        # Rows ingested before bodies were stored: serialize and sign at delivery time
+        body = serialize_payload(event["payload"])
+        signature = sign_payload(body)
     headers = {
         "Content-Type": "application/json",
         "X-Webhook-Signature": signature,
     }
 
     try:
-        with httpx.Client(timeout=HTTP_TIMEOUT) as client:
-            resp = client.post(target_url, content=body, headers=headers)
-        status_code = resp.status_code
-        response_body = resp.text[:2000] if resp.text else None
+        async with _CLIENT.stream("POST", target_url, content=body, headers=headers) as resp:
+            status_code = resp.status_code
+            raw = await read_capped(resp, RESPONSE_BODY_LIMIT)
+        response_body = raw.decode("utf-8", errors="replace") or None
         error = None
     except Exception as e:
         status_code = None
         response_body = None
         error = str(e)
         logger.warning("Delivery failed event_id=%s attempt=%s error=%s", event_id, attempt_number, error)
+    return {"status_code": status_code, "response_body": response_body, "error": error}
+
+
+def record_outcomes(conn: Connection, worker_id: str, events: list[dict], outcomes: list[dict]) -> None:
+    """Record a batch's attempts and mark each event delivered, pending retry, or dead.
+
+    Issues at most three statements per batch: one attempts INSERT and one UPDATE per outcome kind.
+    Status updates only apply while worker_id still holds the claim; events reclaimed by another
+    worker in the meantime are logged and left untouched. Outcomes are logged only once applied.
+    """
+    attempts = []
+    delivered_ids = []
+    failures = []
+    outcome_logs = []  # (event_id, level, msg, args), emitted after the UPDATEs
+    for event, outcome in zip(events, outcomes):
+        event_id = event["id"]
+        attempt_count = event["attempt_count"]
+        attempt_number = attempt_count + 1
+        status_code = outcome["status_code"]
+        response_body = outcome["response_body"]
+        error = outcome["error"]
+
+        attempts.append({
+            "event_id": event_id,
+            "attempt_number": attempt_number,
+            "status_code": status_code,
+            "response_body": response_body,
+            "error": error,
+        })
+
+        if status_code is not None and 200 <= status_code < 300:
+            delivered_ids.append(event_id)
+            outcome_logs.append(
+                (event_id, logging.INFO, "Delivered event_id=%s after %s attempt(s)", (event_id, attempt_number))
+            )
+            continue
+
+        # Failure: backoff or mark dead
+        next_attempt_count = attempt_count + 1
+        next_retry_at = backoff_with_jitter(next_attempt_count)
+        last_error = error or f"HTTP {status_code}: {response_body or 'no body'}"
+        mark_dead = next_attempt_count >= MAX_ATTEMPTS
+        failures.append({
+            "event_id": event_id,
+            "attempt_count": next_attempt_count,
+            "next_retry_at": next_retry_at,
+            "last_error": last_error,
+            "mark_dead": mark_dead,
+        })
+        if mark_dead:
+            outcome_logs.append(
+                (event_id, logging.ERROR, "Event dead after %s attempts event_id=%s", (MAX_ATTEMPTS, event_id))
+            )
+        else:
+            outcome_logs.append((
+                event_id,
+                logging.INFO,
+                "Will retry event_id=%s at %s (attempt %s)",
+                (event_id, next_retry_at.isoformat(), next_attempt_count),
+            ))
+
+    record_attempts(conn, attempts)
+    updated = set()
+    if delivered_ids:
+        updated |= mark_delivered(conn, worker_id, delivered_ids)
+    if failures:
+        updated |= mark_failed(conn, worker_id, failures)
+    for event_id, level, msg, args in outcome_logs:
+        if event_id in updated:
+            logger.log(level, msg, *args)
+        else:
+            logger.warning("Claim on event_id=%s was lost (reclaimed); outcome not applied", event_id)
+
+
+class DeliveryPool:
+    """Caps in-flight deliveries across claimed batches.
+
+    The loop claims only as many events as there are free slots and keeps claiming while earlier
+    batches are still delivering, so one slow or hanging receiver call only holds its own slot.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._freed = asyncio.Event()
+        self._tasks = set()
+
+    @property
+    def free(self) -> int:
+        return self.limit - self.in_flight
+
+    def submit(self, events: list[dict]) -> None:
+        self.in_flight += len(events)
+        task = asyncio.create_task(deliver_batch(events, self))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._freed.set()
+
+    async def wait_for_slot(self) -> None:
+        while self.free <= 0:
+            self._freed.clear()
+            await self._freed.wait()
 
-    record_attempt(
-        session,
-        UUID(str(event_id)),
-        attempt_number,
-        status_code,
-        response_body,
-        error,
-    )
 
-    if status_code is not None and 200 <= status_code < 300:
-        mark_delivered(session, UUID(str(event_id)))
-        logger.info("Delivered event_id=%s after %s attempt(s)", event_id, attempt_number)
+def record_batch(events: list[dict], outcomes: list[dict]) -> None:
+    """Record all outcomes of a batch in one short transaction (run in a thread)."""
+    try:
+        with engine.begin() as conn:
+            record_outcomes(conn, WORKER_ID, events, outcomes)
+    except Exception as e:
+        # Rows stay in_flight and are retried once reclaim_stale_events picks them up
+        logger.exception("Error recording outcomes for %s event(s): %s", len(events), e)
+
+
+async def deliver_batch(events: list[dict], pool: DeliveryPool) -> None:
+    """Deliver a claimed (in_flight) batch concurrently, then record all outcomes together.
+
+    Each event frees its pool slot as soon as its own HTTP call finishes. No DB connection is
+    held while HTTP requests are in flight.
+    """
+
+    async def deliver_and_release(event: dict) -> dict:
+        try:
+            return await deliver_one(event)
+        finally:
+            pool.release()
+
+    outcomes = await asyncio.gather(*(deliver_and_release(event) for event in events))
+    await asyncio.to_thread(record_batch, events, outcomes)
+
+
+def claim_batch(limit: int, reclaim: bool) -> tuple[list[dict], float | None]:
+    """Claim up to limit events in their own transaction (run in a thread).
+
+    in_flight status, not row locks, guards delivery. With reclaim, stale in_flight rows are
+    first returned to pending. When nothing was claimable, also returns the seconds until the
+    next scheduled retry is due (retries send no NOTIFY), else None.
+    """
+    with engine.begin() as conn:
+        if reclaim:
+            reclaimed = reclaim_stale_events(conn, IN_FLIGHT_TIMEOUT)
+            if reclaimed:
+                logger.warning("Reclaimed %s stale in_flight event(s)", reclaimed)
+        events = claim_pending_events(conn, WORKER_ID, limit=limit)
+        next_due = None if events else seconds_until_next_retry(conn)
+    return events, next_due
+
+
+async def wait_for_events(listen_conn, timeout: float) -> None:
+    """Wait until a NOTIFY arrives on listen_conn or timeout elapses (fallback poll)."""
+    if listen_conn is None:
+        await asyncio.sleep(timeout)
         return
+    if not listen_conn.notifies:
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(listen_conn, readable.set)
+        try:
+            with suppress(TimeoutError):
+                await asyncio.wait_for(readable.wait(), timeout)
+        finally:
+            loop.remove_reader(listen_conn)
+        if readable.is_set():
+            listen_conn.poll()
+    listen_conn.notifies.clear()
 
-    # Failure: backoff or mark dead
-    next_attempt_count = attempt_count + 1
-    next_retry_at = backoff_with_jitter(next_attempt_count)
-    last_error = error or f"HTTP {status_code}: {response_body or 'no body'}"
-    mark_dead = next_attempt_count >= MAX_ATTEMPTS
-    mark_failed(
-        session,
-        UUID(str(event_id)),
-        next_attempt_count,
-        next_retry_at,
-        last_error,
-        mark_dead=mark_dead,
-    )
-    if mark_dead:
-        logger.error("Event dead after %s attempts event_id=%s", MAX_ATTEMPTS, event_id)
-    else:
-        logger.info(
-            "Will retry event_id=%s at %s (attempt %s)",
-            event_id,
-            next_retry_at.isoformat(),
-            next_attempt_count,
-        )
 
+def next_poll_delay(current_delay: float) -> float:
+    """Grow the idle poll delay geometrically with jitter, capped at MAX_POLL_INTERVAL."""
+    return min(current_delay * POLLING_INTERVAL_FACTOR + random.uniform(0, 1), MAX_POLL_INTERVAL)
 
-def run_worker_loop() -> None:
-    """Poll DB, claim events, deliver; run until KeyboardInterrupt."""
-    logger.info("Worker started (poll_interval=%s, claim_limit=%s)", POLL_INTERVAL, CLAIM_LIMIT)
+
+async def run_worker_loop() -> None:
+    """Wait for new events (LISTEN/NOTIFY, polling as fallback), claim, deliver; run until KeyboardInterrupt."""
+    logger.info(
+        "Worker started (id=%s, poll_interval=%s, claim_limit=%s, delivery_concurrency=%s)",
+        WORKER_ID,
+        POLL_INTERVAL,
+        CLAIM_LIMIT,
+        DELIVERY_CONCURRENCY,
+    )
+    logger.info("Signing with SHA-256 from %s", hash_backend())
+    listen_conn = None
+    current_delay = POLL_INTERVAL
+    pool = DeliveryPool(DELIVERY_CONCURRENCY)
+    last_reclaim = None
+    next_listen_attempt = 0.0
     while True:
-        try:
-            session = SessionLocal()
+        # Reconnect off the event loop, and no more often than the poll backoff, so an outage
+        # neither stalls in-flight deliveries nor retries (and warns) on every backlog pass
+        if (listen_conn is None or listen_conn.closed) and time.monotonic() >= next_listen_attempt:
             try:
-                events = claim_pending_events(session, limit=CLAIM_LIMIT)
-                for event in events:
-                    try:
-                        deliver_one(session, event)
-                        session.commit()
-                    except Exception as e:
-                        logger.exception("Error delivering event_id=%s: %s", event.get("id"), e)
-                        session.rollback()
-            finally:
-                session.close()
+                listen_conn = await asyncio.to_thread(open_listen_connection)
+            except Exception as e:
+                logger.warning("LISTEN unavailable, falling back to polling: %s", e)
+                listen_conn = None
+                next_listen_attempt = time.monotonic() + current_delay
+        await pool.wait_for_slot()
+        backlog = False
+        next_due = None
+        try:
+            reclaim = last_reclaim is None or time.monotonic() - last_reclaim >= IN_FLIGHT_TIMEOUT
+            limit = min(CLAIM_LIMIT, pool.free)
+            events, next_due = await asyncio.to_thread(claim_batch, limit, reclaim)
+            if reclaim:
+                last_reclaim = time.monotonic()
+            if events:
+                current_delay = POLL_INTERVAL
+                pool.submit(events)
+                # A full batch means more rows are likely ready; they may never NOTIFY (retries)
+                backlog = len(events) == limit
+            else:
+                current_delay = next_poll_delay(current_delay)
         except Exception as e:
             logger.exception("Worker loop error: %s", e)
-        time.sleep(POLL_INTERVAL)
+            current_delay = next_poll_delay(current_delay)
+        if backlog:
+            continue
+        # Wake no later than the next scheduled retry, however far the idle backoff has grown
+        timeout = current_delay if next_due is None else min(current_delay, max(next_due, MIN_WAIT))
+        try:
+            await wait_for_events(listen_conn, timeout)
+        except Exception as e:
+            logger.warning("LISTEN connection lost: %s", e)
+            listen_conn.close()
+            listen_conn = None
+
+
+async def main() -> None:
+    try:
+        await run_worker_loop()
+    finally:
+        await _CLIENT.aclose()
 
 
 if __name__ == "__main__":
-    run_worker_loop()
+    asyncio.run(main())
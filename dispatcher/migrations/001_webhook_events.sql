@@ -11,10 +11,7 @@ CREATE TABLE IF NOT EXISTS webhook_events (
     last_error TEXT
 );
 
--- Index for worker poll: claim pending rows ready for retry
-CREATE INDEX IF NOT EXISTS idx_webhook_events_claim
-    ON webhook_events (status, next_retry_at)
-    WHERE status = 'pending';
+-- Claim index lives in 006_webhook_events_pending_index.sql
 
 -- Index for debugging / listing by time
 CREATE INDEX IF NOT EXISTS idx_webhook_events_created_at
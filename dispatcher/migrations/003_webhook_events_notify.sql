@@ -0,0 +1,25 @@
+-- Wake idle workers as soon as a pending event is inserted (LISTEN webhook_events_new).
+-- Created only when missing so startup does not rewrite the catalog rows on every boot.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'notify_webhook_event') THEN
+        CREATE FUNCTION notify_webhook_event() RETURNS trigger AS $fn$
+        BEGIN
+            PERFORM pg_notify('webhook_events_new', NEW.id::text);
+            RETURN NEW;
+        END;
+        $fn$ LANGUAGE plpgsql;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'webhook_events_notify'
+          AND tgrelid = 'webhook_events'::regclass
+    ) THEN
+        CREATE TRIGGER webhook_events_notify
+            AFTER INSERT ON webhook_events
+            FOR EACH ROW
+            WHEN (NEW.status = 'pending')
+            EXECUTE FUNCTION notify_webhook_event();
+    END IF;
+END $$;
@@ -0,0 +1,40 @@
+-- Claim ownership: workers move rows to 'in_flight' at claim time instead of holding row locks.
+-- Columns are added only when missing: ADD COLUMN IF NOT EXISTS still locks the table on every boot.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name = 'webhook_events'
+          AND column_name = 'locked_at'
+    ) THEN
+        ALTER TABLE webhook_events ADD COLUMN locked_at TIMESTAMPTZ;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name = 'webhook_events'
+          AND column_name = 'locked_by'
+    ) THEN
+        ALTER TABLE webhook_events ADD COLUMN locked_by TEXT;
+    END IF;
+END $$;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'webhook_events_status_check'
+          AND position('in_flight' in pg_get_constraintdef(oid)) > 0
+    ) THEN
+        ALTER TABLE webhook_events DROP CONSTRAINT IF EXISTS webhook_events_status_check;
+        ALTER TABLE webhook_events ADD CONSTRAINT webhook_events_status_check
+            CHECK (status IN ('pending', 'in_flight', 'delivered', 'dead'));
+    END IF;
+END $$;
+
+-- Index for crash recovery: find in_flight rows whose worker never reported back
+CREATE INDEX IF NOT EXISTS idx_webhook_events_in_flight
+    ON webhook_events (locked_at)
+    WHERE status = 'in_flight';
@@ -0,0 +1,22 @@
+-- Exact signed request body and its HMAC, computed once at ingest and reused on every retry.
+-- Columns are added only when missing: ADD COLUMN IF NOT EXISTS still locks the table on every boot.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name = 'webhook_events'
+          AND column_name = 'body'
+    ) THEN
+        ALTER TABLE webhook_events ADD COLUMN body BYTEA;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name = 'webhook_events'
+          AND column_name = 'signature'
+    ) THEN
+        ALTER TABLE webhook_events ADD COLUMN signature TEXT;
+    END IF;
+END $$;
@@ -0,0 +1,8 @@
+-- Index for the claim_pending_events next_retry_at filter: only pending rows, so it stays small
+-- (sized to the queue depth, not total events). Replaces idx_webhook_events_claim, whose leading
+-- status column is redundant under the same WHERE status = 'pending' predicate.
+DROP INDEX IF EXISTS idx_webhook_events_claim;
+
+CREATE INDEX IF NOT EXISTS idx_webhook_events_pending
+    ON webhook_events (next_retry_at NULLS FIRST, created_at)
+    WHERE status = 'pending';
@@ -6,11 +6,9 @@ import asyncio
 import hmac
 import hashlib
 import logging
+import math
 import os
 import random
-from contextlib import asynccontextmanager
-
-from fastapi import FastAPI, Request, Response
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("mock_receiver")
@@ -21,62 +19,191 @@ MAX_DELAY_SEC = float(os.environ.get("MAX_DELAY_SEC", "5"))
 HANG_RATE = float(os.environ.get("HANG_RATE", "0.08"))  # 8% hold connection (timeout)
 PORT = int(os.environ.get("PORT", "8080"))
 
-
-def verify_signature(secret: str, body: bytes, header: str | None) -> bool:
-    """Constant-time compare of X-Webhook-Signature with HMAC-SHA256(secret, body)."""
+# Private RNG instance for the chaos decisions
+_rng = random.Random()
+
+
+class TimerWheel:
+    """Hashed timer wheel for the chaos sleeps: O(1) scheduling, one sweeper task for all sleepers.
+
+    Each slot holds [rounds, future] entries; every tick (resolution seconds) the sweeper resolves
+    the entries in the current slot whose rounds reached zero. The sweeper idles while nothing waits.
+    """
+
+    def __init__(self, resolution: float = 0.01, slots: int = 1024):
+        self.resolution = resolution
+        self.slots = slots
+        self._buckets = [[] for _ in range(slots)]
+        self._tick = 0
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def sleep(self, delay: float) -> asyncio.Future:
+        """Return a future resolved once delay seconds (rounded up to a tick) have passed."""
+        loop = asyncio.get_running_loop()
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+        ticks = max(1, math.ceil(delay / self.resolution))
+        rounds, offset = divmod(ticks - 1, self.slots)
+        future = loop.create_future()
+        self._buckets[(self._tick + offset + 1) % self.slots].append([rounds, future])
+        self._pending += 1
+        self._wakeup.set()
+        return future
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _expire(self, bucket: list) -> None:
+        keep = []
+        for entry in bucket:
+            rounds, future = entry
+            if future.done():  # sleeper was cancelled (client went away)
+                self._pending -= 1
+            elif rounds == 0:
+                future.set_result(None)
+                self._pending -= 1
+            else:
+                entry[0] = rounds - 1
+                keep.append(entry)
+        bucket[:] = keep
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                last = loop.time()
+            await asyncio.sleep(self.resolution)
+            elapsed = int((loop.time() - last) / self.resolution)
+            last += elapsed * self.resolution
+            for _ in range(elapsed):
+                self._tick += 1
+                self._expire(self._buckets[self._tick % self.slots])
+
+
+_wheel = TimerWheel()
+
+
+def _hmac_prototypes(secret: str) -> tuple:
+    """SHA-256 states pre-fed with the HMAC ipad/opad keys, so verification skips key processing."""
+    key = secret.encode("utf-8")
+    if len(key) > 64:
+        key = hashlib.sha256(key).digest()
+    key = key.ljust(64, b"\x00")
+    return hashlib.sha256(bytes(b ^ 0x36 for b in key)), hashlib.sha256(bytes(b ^ 0x5C for b in key))
+
+
+_INNER_PROTO, _OUTER_PROTO = _hmac_prototypes(WEBHOOK_SECRET)
+
+
+def verify_signature(body: bytes, header: str | None) -> bool:
+    """Constant-time compare of X-Webhook-Signature with HMAC-SHA256(WEBHOOK_SECRET, body)."""
     if not header or not header.startswith("sha256="):
         return False
-    expected = header.removeprefix("sha256=")
-    computed = hmac.new(
-        secret.encode("utf-8"),
-        body,
-        hashlib.sha256,
-    ).hexdigest()
-    return hmac.compare_digest(computed, expected)
-
-
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    logger.info("Mock receiver started (failure_rate=%s, max_delay=%s)", FAILURE_RATE, MAX_DELAY_SEC)
-    yield
-
-
-app = FastAPI(lifespan=lifespan)
-
-@app.get("/webhook")
-async def webhook_get():
+    try:
+        expected = bytes.fromhex(header.removeprefix("sha256="))
+    except ValueError:
+        return False
+    inner = _INNER_PROTO.copy()
+    inner.update(body)
+    outer = _OUTER_PROTO.copy()
+    outer.update(inner.digest())
+    return hmac.compare_digest(outer.digest(), expected)
+
+
+async def read_body(receive) -> bytes:
+    """Collect the full request body from ASGI http.request messages."""
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def send_response(send, status: int, content: bytes, content_type: bytes | None = None) -> None:
+    headers = [(b"content-length", str(len(content)).encode())]
+    if content_type:
+        headers.append((b"content-type", content_type))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            logger.info("Mock receiver started (failure_rate=%s, max_delay=%s)", FAILURE_RATE, MAX_DELAY_SEC)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await _wheel.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def webhook_get(send) -> None:
     """Allow GET for browser/health checks; return hint to use POST for delivery."""
-    return Response(
-        status_code=200,
-        content='{"message": "Webhook receiver. Use POST with X-Webhook-Signature to deliver webhooks."}',
-        media_type="application/json",
+    await send_response(
+        send,
+        200,
+        b'{"message": "Webhook receiver. Use POST with X-Webhook-Signature to deliver webhooks."}',
+        b"application/json",
     )
 
 
-@app.post("/webhook")
-async def webhook(request: Request):
-    body = await request.body()
-    sig = request.headers.get("X-Webhook-Signature")
+async def webhook(scope, receive, send) -> None:
+    body = await read_body(receive)
+    sig = next(
+        (value.decode("latin-1") for name, value in scope["headers"] if name == b"x-webhook-signature"),
+        None,
+    )
 
-    if not verify_signature(WEBHOOK_SECRET, body, sig):
+    if not verify_signature(body, sig):
         logger.warning("Invalid or missing signature")
-        return Response(status_code=401, content="Invalid signature")
+        await send_response(send, 401, b"Invalid signature")
+        return
 
     # Occasional "offline": hold connection until client times out
-    if random.random() < HANG_RATE:
+    if _rng.random() < HANG_RATE:
         logger.info("Simulating offline: holding connection")
-        await asyncio.sleep(60)
-        return Response(status_code=504, content="Gateway Timeout (simulated)")
+        await _wheel.sleep(60)
+        await send_response(send, 504, b"Gateway Timeout (simulated)")
+        return
 
     # Random delay 0–MAX_DELAY_SEC
-    delay = random.uniform(0, MAX_DELAY_SEC)
+    delay = _rng.uniform(0, MAX_DELAY_SEC)
     logger.info("Delay %.2fs then respond", delay)
-    await asyncio.sleep(delay)
+    await _wheel.sleep(delay)
 
     # ~70% failure: 500 or "timeout" (we already might have delayed a lot)
-    if random.random() < FAILURE_RATE:
+    if _rng.random() < FAILURE_RATE:
         logger.info("Returning 500 (chaos)")
-        return Response(status_code=500, content="Internal Server Error (chaos)")
+        await send_response(send, 500, b"Internal Server Error (chaos)")
+        return
 
     logger.info("Success 200 body_len=%s", len(body))
-    return Response(status_code=200, content='{"received": true}')
+    await send_response(send, 200, b'{"received": true}')
+
+
+async def app(scope, receive, send) -> None:
+    """Raw ASGI entrypoint: one route, matched directly on path and method (no framework routing)."""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if scope["path"] != "/webhook":
+        await send_response(send, 404, b"Not Found")
+    elif scope["method"] == "POST":
+        await webhook(scope, receive, send)
+    elif scope["method"] == "GET":
+        await webhook_get(send)
+    else:
+        await send_response(send, 405, b"Method Not Allowed")